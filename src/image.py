@@ -1,70 +1,206 @@
-import logging
+import re
 import astropy.units as units
 import numpy as np
 from typing import Any
 from astropy import stats
-from astropy.nddata import Cutout2D
-from astropy.coordinates import SkyCoord
+from astropy.coordinates import Latitude, Longitude
 from astropy.io import fits
 from astropy import wcs
 
 
+POINT = re.compile(r"point\(\s*([^,\s]+)\s*,\s*([^)\s]+)\s*\)")
+
+
+def _wcs_key(projection: wcs.WCS) -> tuple | None:
+    """
+        Hashable summary of a linear WCS, or None when distortion
+        tables make it unsafe to compare by keywords alone
+    """
+    if projection.has_distortion:
+        return None
+    projection.wcs.set()
+    return (tuple(projection.wcs.ctype), tuple(projection.wcs.crval), tuple(projection.wcs.crpix),
+            tuple(projection.pixel_scale_matrix.ravel()), tuple(projection.wcs.get_pv()),
+            projection.wcs.lonpole, projection.wcs.latpole)
+
+
+def _degrees(tokens: tuple, angle: type, unit: units.Unit) -> np.ndarray:
+    """
+        Degrees for each region token, reading plain numbers as degrees
+        and parsing only the sexagesimal ones, in a single vectorised call
+    """
+    degrees = np.empty(len(tokens))
+    sexagesimal = []
+    for i, token in enumerate(tokens):
+        try:
+            degrees[i] = float(token)
+        except ValueError:
+            sexagesimal.append(i)
+    if sexagesimal:
+        degrees[sexagesimal] = angle([tokens[i] for i in sexagesimal], unit=unit).degree
+    return degrees
+
+
 class ImageGenerator:
 
-    cutout: Cutout2D = None
-    coordinates: fits.HDUList = None
+    cutout: np.ndarray = None
+    cutout_wcs: wcs.WCS = None
+    coordinates: np.ndarray = None
+    world: np.ndarray = None
     averages: dict = {}
     filename: str = ""
+    _source: Any = None
+    _hdul: fits.HDUList = None
+    _data: np.ndarray = None
+    _scaling: tuple = (1, 0, None)
+    _wcs: wcs.WCS = None
+    _pixels: dict = None
 
     def __init__(self, file: str) -> None:
         self.filename = file
 
-    def generate_coordinates(self, coordinates: list) -> None:
-        try:
-            array = []
-            for line in coordinates:
-                if "point" in line:
-                    ra = line[6:18]
-                    dec = line[19:31]
-                    coordinate = SkyCoord(ra, dec, unit=(units.hourangle, units.degree), frame='fk5')
-                    array.append([coordinate.ra.degree, coordinate.dec.degree])
-            self.coordinates =  coordinates.wcs_world2pix(array, 1)
-        except Exception as e:
-            logging.error(e)
-
-    def generate_cutout(self, image: str, position: tuple) -> None:
-        try:
-            fittings: fits.HDUList  = fits.open(image)
-            coordinates: wcs.WCS = wcs.WCS(fittings[0].header)
-            self.image =  Cutout2D(fittings[0].data, position, (51, 51), coordinates)
-        except Exception as e:
-            logging.error(e)
+    def read_regions(self, coordinates: list) -> None:
+        self._pixels = {}
+        points = [match.groups() for match in map(POINT.search, coordinates) if match]
+        if not points:
+            self.world = np.empty((0, 2))
+            return
+        right_ascension, declination = zip(*points)
+        ra = _degrees(right_ascension, Longitude, units.hourangle)
+        dec = _degrees(declination, Latitude, units.degree)
+        self.world = np.column_stack([ra, dec])
+
+    def generate_coordinates(self, coordinates: list = None, projection: wcs.WCS = None) -> None:
+        ## Region lines only need parsing once; later bands reuse self.world with their own WCS
+        if coordinates is not None:
+            self.read_regions(coordinates)
+        if self.world is None:
+            raise ValueError("Error: No region coordinates have been read")
+        projection = self._wcs if projection is None else projection
+        if projection is None:
+            raise ValueError("Error: No WCS to project the coordinates onto")
+        ## Bands sharing a tangent plane reuse the pixel coordinates already computed for it
+        key = _wcs_key(projection)
+        if key is None:
+            self.coordinates = projection.wcs_world2pix(self.world, 1)
+            return
+        if key not in self._pixels:
+            pixels = projection.wcs_world2pix(self.world, 1)
+            ## Shared between bands, so guard the cached array against in-place edits
+            pixels.flags.writeable = False
+            self._pixels[key] = pixels
+        self.coordinates = self._pixels[key]
+
+    def __enter__(self) -> "ImageGenerator":
+        return self
 
-    def generate_plot(self, zeros: list) -> None:
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def open(self, image: str | fits.HDUList) -> None:
+        self.close()
+        if isinstance(image, fits.HDUList):
+            self._hdul = image
+            self._scaling = (1, 0, None)
+        else:
+            ## Keep the raw memory map and only rescale the stamps that are actually cut out
+            self._hdul = fits.open(image, memmap=True, do_not_scale_image_data=True)
+            header = self._hdul[0].header
+            blank = header.get("BLANK") if self._hdul[0].data.dtype.kind in "iu" else None
+            self._scaling = (header.get("BSCALE", 1), header.get("BZERO", 0), blank)
+        self._data = self._hdul[0].data
+        self._wcs = wcs.WCS(self._hdul[0].header)
+        self._source = image
+
+    def close(self) -> None:
+        ## Only handles opened from a path are ours to close; caller HDULists stay open
+        if self._hdul is not None and not isinstance(self._source, fits.HDUList):
+            self._hdul.close()
+        self._hdul = None
+        self._data = None
+        self._wcs = None
+        self._source = None
+
+    def cutout_at(self, position: tuple) -> np.ndarray | None:
+        if self._data is None:
+            raise ValueError("Error: No image has been opened")
+        ## Positions that failed to project (NaN) have no stamp, like those off the edge
+        if not np.isfinite(position).all():
+            self.cutout = None
+            self.cutout_wcs = None
+            return None
+        ## Slice the 51x51 stamp directly rather than building a Cutout2D, rounding the
+        ## corner the same way Cutout2D does so half-pixel positions pick the same stamp
+        x0 = int(np.ceil(position[0] - 25.5))
+        y0 = int(np.ceil(position[1] - 25.5))
+        height, width = self._data.shape
+        if x0 < 0 or y0 < 0 or x0 + 51 > width or y0 + 51 > height:
+            self.cutout = None
+            self.cutout_wcs = None
+            return None
+        self.cutout = self._scaled(self._data[y0:y0 + 51, x0:x0 + 51])
+        ## Slicing the WCS shifts SIP's CRPIX along with the core one
+        self.cutout_wcs = self._wcs[y0:y0 + 51, x0:x0 + 51]
+        self.cutout_wcs.array_shape = (51, 51)
+        return self.cutout
+
+    def cutouts(self, positions: np.ndarray) -> tuple:
+        if self._data is None:
+            raise ValueError("Error: No image has been opened")
+        ## Gather every in-bounds stamp with one fancy index instead of a per-position loop,
+        ## laid out (51, 51, N) so each pixel's samples are contiguous for the stacking reductions
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+        ## Only cast finite rows; NaN-to-int is platform dependent and could select a corner stamp
+        finite = np.isfinite(positions).all(axis=1)
+        corners = np.zeros(positions.shape, dtype=int)
+        corners[finite] = np.ceil(positions[finite] - 25.5)
+        x, y = corners[:, 0], corners[:, 1]
+        height, width = self._data.shape
+        keep = finite & (x >= 0) & (x + 51 <= width) & (y >= 0) & (y + 51 <= height)
+        dy, dx = np.mgrid[0:51, 0:51]
+        stamps = self._data[dy[..., None] + y[keep], dx[..., None] + x[keep]]
+        return np.ascontiguousarray(self._scaled(stamps), dtype=np.float32), keep
+
+    def _scaled(self, stamp: np.ndarray) -> np.ndarray:
+        bscale, bzero, blank = self._scaling
+        if bscale == 1 and bzero == 0 and blank is None:
+            return stamp
+        scaled = stamp * float(bscale) + float(bzero)
+        ## Undefined integer pixels become NaN, as astropy's own scaling does
+        if blank is not None:
+            scaled[stamp == blank] = np.nan
+        return scaled
+
+    def generate_cutout(self, image: str | fits.HDUList, position: tuple) -> np.ndarray | None:
+        ## Only reopen and re-parse the WCS when the image changes
+        if image is not self._source and image != self._source:
+            self.open(image)
+        return self.cutout_at(position)
+
+    def generate_plot(self, averages: np.ndarray, zeros: list) -> list:
         ## TODO: Fix this method to generate proper plot
-        try:
-            if self.cutout is None or self.coordinates is None or self.averages == {}:
-                raise Exception("Error: Cutout, Coordinates, or Averages are not defined")
-            else:
-                for i in range(len(self.averages)):
-                    first_image_hdu = fits.ImageHDU(self.averages[i])
-                    second_image_hdu = fits.ImageHDU(zeros[i])
-                    empty_primary = fits.PrimaryHDU()
-                    fits.HDUList([empty_primary, first_image_hdu, second_image_hdu])
-        except Exception as e:
-            logging.error(e)
-
-    def get_averages(self, averages: list, mad: list, images: list, file_path: str, galaxies: int) -> None:
+        if not len(averages) or len(averages) != len(zeros):
+            raise ValueError("Error: Averages and zeros must be non-empty and the same length")
+        hdu_lists = []
+        for average, zero in zip(averages, zeros):
+            first_image_hdu = fits.CompImageHDU(average, compression_type="RICE_1", quantize_level=16)
+            second_image_hdu = fits.CompImageHDU(zero, compression_type="RICE_1", quantize_level=16)
+            empty_primary = fits.PrimaryHDU()
+            hdu_lists.append(fits.HDUList([empty_primary, first_image_hdu, second_image_hdu]))
+        return hdu_lists
+
+    def get_averages(self, images: list, file_path: str, galaxies: int) -> tuple:
         ## TODO: Remove hardcoded filename and average
-        try:
-            for image in images:
-                averages.append(np.mean(stats.sigma_clip(image, axis=0), axis=0))
-                mad.append(1.5 * stats.median_absolute_deviation((image)/np.sqrt(galaxies-1), axis=0))
-                file_name = file_path + "zeropoints.txt"
-                reader = open(file_name)
-                lines = reader.readlines()
-                for line in lines:
-                    line = line.split(' ')
-                    self.averages[line[0]] = float(line[1])
-        except Exception as e:
-            logging.error(e)
\ No newline at end of file
+        if not len(images):
+            raise ValueError("Error: No images to average")
+        with open(file_path + "zeropoints.txt") as reader:
+            self.averages = {line[0]: float(line[1]) for line in map(str.split, reader) if line}
+        height, width = np.shape(images[0])[:2]
+        averages = np.empty((len(images), height, width), dtype=np.float32)
+        mad = np.empty_like(averages)
+        for i, image in enumerate(images):
+            ## Stamp stacks are (H, W, N) and C-contiguous so the per-pixel reductions run along stride-1 memory
+            image = np.ascontiguousarray(image, dtype=np.float32)
+            averages[i], _, _ = stats.sigma_clipped_stats(image, axis=-1)
+            mad[i] = 1.5 * stats.median_absolute_deviation(image / np.sqrt(galaxies - 1), axis=-1)
+        return averages, mad
\ No newline at end of file
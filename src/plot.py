@@ -1,5 +1,23 @@
 import logging
 import numpy as np
+from functools import lru_cache
+
+
+@lru_cache(maxsize=32)
+def _radius_index(shape: tuple, center: tuple) -> tuple:
+    """
+        Integer pixel radius of every pixel plus the per-annulus counts,
+        cached because stamps share a shape and centre
+    """
+    y, x = np.indices(shape)
+    r = np.sqrt((x - center[0]) ** 2 + (y - center[1]) ** 2).astype(int).ravel()
+    nr = np.bincount(r)
+    ## Radii are integer bin indices, so the non-empty bins are the radii themselves
+    radii = np.nonzero(nr)[0]
+    nr = nr[radii]
+    for array in (r, nr, radii):
+        array.flags.writeable = False
+    return r, nr, radii
 
 class Plot:
     """
@@ -31,13 +49,33 @@ class Plot:
         except Exception as e:
             logging.error(e)
 
-    def profile(data: np.ndarray, center: list, scale: int) -> None:
+    @staticmethod
+    def profile(data: np.ndarray, center: list, scale: int) -> tuple:
         """
             This method calculates the radial profile
             -   Parameters
-            -   
+                -   data: stamp to profile
+                -   center: (x, y) pixel the annuli are centred on
+                -   scale: pixel scale in arcsec per pixel
+            -   Returns radius (arcsec), surface brightness and its
+                standard error per integer pixel annulus
         """
         try:
-            return None
+            r, nr, radii = _radius_index(np.shape(data), tuple(center))
+            values = np.asarray(data, dtype=np.float64).ravel()
+            ## One bincount pass each for sums and sums of squares
+            tbin = np.bincount(r, values)
+            tbin2 = np.bincount(r, values * values)
+            mean = tbin[radii] / nr
+            ## Work in place on the fancy-indexed copies to avoid further temporaries
+            error = tbin2[radii] / nr
+            error -= mean * mean
+            np.maximum(error, 0, out=error)
+            np.sqrt(error, out=error)
+            error /= np.sqrt(nr)
+            inv_scale2 = 1.0 / (scale * scale)
+            mean *= inv_scale2
+            error *= inv_scale2
+            return radii * scale, mean, error
         except Exception as e:
             logging.error(e)
\ No newline at end of file
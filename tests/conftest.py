@@ -0,0 +1,19 @@
+import numpy as np
+import pytest
+from astropy import wcs
+from astropy.io import fits
+
+
+@pytest.fixture(scope="session")
+def test_image(tmp_path_factory) -> str:
+    """
+        Writes a blank 200x200 image with a TAN projection once per session
+    """
+    coordinates = wcs.WCS(naxis=2)
+    coordinates.wcs.ctype = ["RA---TAN", "DEC--TAN"]
+    coordinates.wcs.crval = [150.0, 2.0]
+    coordinates.wcs.crpix = [100.5, 100.5]
+    coordinates.wcs.cd = [[-0.0002, 0.0], [0.0, 0.0002]]
+    file_name = tmp_path_factory.mktemp("images") / "test_image.fits"
+    fits.writeto(file_name, np.zeros((200, 200), dtype=np.float32), coordinates.to_header())
+    return str(file_name)
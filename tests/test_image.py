@@ -1,22 +1,298 @@
+import numpy as np
+import pytest
+from astropy import wcs
+from astropy.io import fits
+from astropy.nddata import Cutout2D
 from src.image import ImageGenerator
 
 
-def test_generate_image():
+def test_generate_image(test_image):
     """
         Tests the generate_image function
     """
     # Arrange
-    image = ImageGenerator()
+    with ImageGenerator(test_image) as image:
+        # Act
+        image.generate_cutout(test_image, (100, 100))
+        # Assert
+        assert image.cutout is not None
+        assert image.cutout.shape == (51, 51)
+        assert not np.any(image.cutout)
+
+
+def test_generate_cutout_open_handle(test_image):
+    """
+        Tests that an already opened image is reused across cutouts
+    """
+    # Arrange
+    image = ImageGenerator(test_image)
+    handle = fits.open(test_image, memmap=True)
     # Act
-    image.generate_cutout("test/images/test_image.fits", (0, 0))
+    image.generate_cutout(handle, (100, 100))
+    coordinates = image._wcs
+    image.generate_cutout(handle, (60, 60))
     # Assert
-    assert image.cutout is not None
+    assert image._wcs is coordinates
     assert image.cutout.shape == (51, 51)
-    assert image.cutout.data.shape == (51, 51)
-    assert image.cutout.data[0][0] == 0.0
-    assert image.cutout.data[50][50] == 0.0
-    assert image.cutout.data[25][25] == 0.0
+    assert image.cutout_wcs.wcs.crpix[0] == pytest.approx(100.5 - 35)
+    handle.close()
+
+
+def test_cutout_at_after_open(test_image):
+    """
+        Tests cutting several positions from a single open
+    """
+    # Arrange
+    with ImageGenerator(test_image) as image:
+        image.open(test_image)
+        # Act
+        shapes = []
+        for position in [(50, 50), (100, 100), (150, 150)]:
+            image.cutout_at(position)
+            shapes.append(image.cutout.shape)
+        # Assert
+        assert shapes == [(51, 51)] * 3
+        assert image.cutout_wcs is not image._wcs
+
+
+def test_generate_coordinates(test_image):
+    """
+        Tests that decimal and sexagesimal regions map to the same pixels
+    """
+    # Arrange
+    with ImageGenerator(test_image) as image:
+        image.open(test_image)
+        decimal = ["fk5", "point(150.00000000,2.00000000)", "point(150.01,2.01)"]
+        sexagesimal = ["fk5", "point(10:00:00.000,+02:00:00.00)", "point(10:00:02.400,+02:00:36.00)"]
+        # Act
+        image.generate_coordinates(decimal)
+        from_decimal = image.coordinates
+        image.generate_coordinates(sexagesimal)
+        # Assert
+        assert from_decimal.shape == (2, 2)
+        np.testing.assert_allclose(from_decimal[0], [100.5, 100.5])
+        np.testing.assert_allclose(image.coordinates, from_decimal)
+
+
+def test_read_regions_mixed_formats():
+    """
+        Tests that decimal points keep degree units next to sexagesimal ones
+    """
+    # Arrange
+    image = ImageGenerator("")
+    # Act
+    image.read_regions(["fk5", "point(150.0,2.0)", "point(10:00:00,+02:00:00)", "point(10:00:00,2.5)"])
+    # Assert
+    np.testing.assert_allclose(image.world, [[150.0, 2.0], [150.0, 2.0], [150.0, 2.5]])
+
+
+def test_generate_coordinates_reuses_regions(test_image):
+    """
+        Tests projecting one parsed region list onto a second band's WCS
+    """
+    # Arrange
+    with ImageGenerator(test_image) as image:
+        image.open(test_image)
+        image.read_regions(["fk5", "point(150.01,2.01)"])
+        shifted = image._wcs.deepcopy()
+        shifted.wcs.crpix += [10, -5]
+        # Act
+        image.generate_coordinates()
+        first = image.coordinates
+        image.generate_coordinates(projection=shifted)
+        second = image.coordinates
+        image.generate_coordinates(projection=image._wcs.deepcopy())
+        # Assert
+        np.testing.assert_allclose(second - first, [[10, -5]])
+        assert image.coordinates is first
+        with pytest.raises(ValueError):
+            image.coordinates[0, 0] = 0.0
+
+
+def test_get_averages(tmp_path):
+    """
+        Tests that outlying stamps are clipped from the average
+    """
+    # Arrange
+    image = ImageGenerator("")
+    (tmp_path / "zeropoints.txt").write_text("J 25.0\nK 24.5\n\n")
+    stack = np.ones((5, 5, 20))
+    stack[..., 0] = 1000.0
+    # Act
+    averages, mad = image.get_averages([stack, np.asfortranarray(2 * stack)], str(tmp_path) + "/", 20)
+    # Assert
+    assert averages.shape == mad.shape == (2, 5, 5)
+    assert averages.dtype == np.float32
+    np.testing.assert_allclose(averages[0], np.ones((5, 5)))
+    np.testing.assert_allclose(averages[1], 2 * np.ones((5, 5)))
+    np.testing.assert_allclose(mad, np.zeros((2, 5, 5)))
+    assert image.averages == {"J": 25.0, "K": 24.5}
+    assert ImageGenerator.averages == {}
+
+
+def test_cutout_at_matches_cutout2d():
+    """
+        Tests stamps and SIP WCSs against Cutout2D, including half-pixel positions
+    """
+    # Arrange
+    projection = wcs.WCS(naxis=2)
+    projection.wcs.ctype = ["RA---TAN-SIP", "DEC--TAN-SIP"]
+    projection.wcs.crval = [150.0, 2.0]
+    projection.wcs.crpix = [100.5, 100.5]
+    projection.wcs.cd = [[-2e-4, 0.0], [0.0, 2e-4]]
+    a = np.zeros((3, 3))
+    b = np.zeros((3, 3))
+    a[2, 0] = 1e-4
+    b[0, 2] = 2e-4
+    projection.sip = wcs.Sip(a, b, None, None, projection.wcs.crpix)
+    data = np.arange(200 * 200, dtype=np.float32).reshape(200, 200)
+    image = ImageGenerator("")
+    image.open(fits.HDUList([fits.PrimaryHDU(data, projection.to_header(relax=True))]))
+    pixels = np.array([[3.0, 4.0], [40.0, 20.0]])
+    for position in [(60, 70), (100.5, 100.5), (60.5, 70.5)]:
+        # Act
+        stamp = image.cutout_at(position)
+        expected = Cutout2D(data, position, (51, 51), image._wcs)
+        # Assert
+        np.testing.assert_array_equal(stamp, expected.data)
+        np.testing.assert_allclose(image.cutout_wcs.sip.crpix, expected.wcs.sip.crpix)
+        assert image.cutout_wcs.array_shape == (51, 51)
+        np.testing.assert_allclose(image.cutout_wcs.all_pix2world(pixels, 0), expected.wcs.all_pix2world(pixels, 0))
+
+
+def test_cutout_at_out_of_bounds(test_image):
+    """
+        Tests that stamps overlapping the image edge are skipped
+    """
+    # Arrange
+    with ImageGenerator(test_image) as image:
+        image.open(test_image)
+        # Act
+        stamp = image.cutout_at((10, 100))
+        # Assert
+        assert stamp is None
+        assert image.cutout is None
+        assert image.cutout_at((25, 174)).shape == (51, 51)
+        assert image.cutout_at((np.nan, 100)) is None
+        assert image.cutout is None
+
+
+def test_cutouts_matches_cutout_at():
+    """
+        Tests that the batched gather matches single cutouts and skips edges
+    """
+    # Arrange
+    image = ImageGenerator("")
+    image.open(fits.HDUList([fits.PrimaryHDU(np.arange(200 * 150, dtype=np.float64).reshape(150, 200))]))
+    positions = np.array([[30.2, 40.7], [10, 100], [174, 124], [100, 140], [100.5, 60.5], [25.5, 124.5],
+                          [np.nan, np.nan], [25.5, np.nan]])
+    # Act
+    stamps, keep = image.cutouts(positions)
+    # Assert
+    assert keep.tolist() == [True, False, True, False, True, True, False, False]
+    assert stamps.shape == (51, 51, 4)
+    assert stamps.dtype == np.float32
+    for stamp, position in zip(np.moveaxis(stamps, -1, 0), positions[keep]):
+        np.testing.assert_array_equal(stamp, image.cutout_at(position))
+        np.testing.assert_array_equal(stamp, Cutout2D(image._data, position, (51, 51)).data)
+
+
+def test_cutouts_scaled_image(tmp_path):
+    """
+        Tests that BSCALE/BZERO are applied to stamps from a raw memory map
+    """
+    # Arrange
+    file_name = str(tmp_path / "scaled.fits")
+    hdu = fits.PrimaryHDU(np.arange(100 * 100, dtype=np.float32).reshape(100, 100))
+    hdu.scale("int16", bscale=0.5, bzero=5000)
+    hdu.writeto(file_name)
+    with ImageGenerator(file_name) as image:
+        image.open(file_name)
+        # Act
+        stamps, _ = image.cutouts([[50, 50]])
+        # Assert
+        assert image._data.dtype == np.dtype(">i2")
+        np.testing.assert_allclose(stamps[..., 0], fits.getdata(file_name)[25:76, 25:76])
+        np.testing.assert_allclose(image.cutout_at((50, 50)), stamps[..., 0])
+
+
+def test_close_releases_owned_handles(tmp_path):
+    """
+        Tests that path-opened images are closed and caller handles are not
+    """
+    # Arrange
+    file_name = tmp_path / "owned.fits"
+    fits.writeto(file_name, np.zeros((60, 60), dtype=np.float32))
+    handle = fits.open(file_name)
+    # Act
+    with ImageGenerator(str(file_name)) as image:
+        image.open(file_name)
+        owned = image._hdul
+        image.open(handle)
+        assert owned._file.closed
+    # Assert
+    assert image._hdul is None
+    assert not handle._file.closed
+    handle.close()
+
+
+def test_generate_plot(tmp_path):
+    """
+        Tests that each averaged band is built as a compressed HDUList
+    """
+    # Arrange
+    image = ImageGenerator("")
+    (tmp_path / "zeropoints.txt").write_text("J 25.0\nK 24.5\n")
+    averages, mad = image.get_averages([np.ones((5, 5, 4)), 2 * np.ones((5, 5, 4))], str(tmp_path) + "/", 4)
+    averages[1] += np.linspace(0, 1, 25, dtype=np.float32).reshape(5, 5)
+    # Act
+    hdu_lists = image.generate_plot(averages, mad)
+    hdu_lists[1].writeto(tmp_path / "stacked_K.fits")
+    # Assert
+    assert len(hdu_lists) == 2
+    with fits.open(tmp_path / "stacked_K.fits") as written:
+        assert isinstance(written[1], fits.CompImageHDU)
+        assert written[1].compression_type == "RICE_1"
+        np.testing.assert_allclose(written[1].data, averages[1], atol=0.05)
+    with pytest.raises(ValueError):
+        image.generate_plot(averages, mad[:1])
+
+
+@pytest.mark.parametrize("bscale", [1.0, 0.5])
+def test_cutouts_blank_pixels(tmp_path, bscale):
+    """
+        Tests that BLANK integer pixels come back as NaN like fits.getdata
+    """
+    # Arrange
+    file_name = str(tmp_path / "blank.fits")
+    data = np.arange(100 * 100, dtype=np.int16).reshape(100, 100)
+    data[50, 50] = -32768
+    hdu = fits.PrimaryHDU(data)
+    hdu.header["BLANK"] = -32768
+    hdu.header["BSCALE"] = bscale
+    hdu.writeto(file_name)
+    with ImageGenerator(file_name) as image:
+        image.open(file_name)
+        # Act
+        stamps, _ = image.cutouts([[50, 50]])
+        stamp = image.cutout_at((50, 50))
+        # Assert
+        expected = fits.getdata(file_name)[25:76, 25:76]
+        assert np.isnan(expected[25, 25])
+        np.testing.assert_allclose(stamps[..., 0], expected)
+        np.testing.assert_allclose(stamp, expected)
+
+
+def test_cutout_at_without_open():
+    """
+        Tests that cutting before opening an image raises
+    """
+    # Arrange
+    image = ImageGenerator("")
+    # Act / Assert
+    with pytest.raises(ValueError):
+        image.cutout_at((25, 25))
+
 
 if __name__ == "__main__":
-    test_generate_image()
-    print("test_image.py passed \033[92m\033[1m\u2713\033[0m")
\ No newline at end of file
+    pytest.main([__file__])
@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+from src.plot import Plot, _radius_index
+
+
+def test_profile():
+    """
+        Tests the radial profile of a bright central patch
+    """
+    # Arrange
+    data = np.zeros((21, 21))
+    data[9:12, 9:12] = 100.0
+    data[0, 0] = 7.0
+    # Act
+    radius, profile, error = Plot.profile(data, (10, 10), 0.5)
+    # Assert
+    np.testing.assert_allclose(radius, 0.5 * np.arange(15))
+    np.testing.assert_allclose(profile[:2], 400.0)
+    assert not np.any(profile[2:-1])
+    y, x = np.indices(data.shape)
+    outer = data[np.hypot(x - 10, y - 10).astype(int) == 14]
+    assert error[-1] == pytest.approx(np.std(outer) / np.sqrt(outer.size) / 0.25)
+
+
+def test_profile_reuses_radius_index():
+    """
+        Tests that stamps of one shape and centre share the radius lookup
+    """
+    # Arrange
+    stamps = np.ones((3, 51, 51))
+    hits = _radius_index.cache_info().hits
+    # Act
+    profiles = [Plot.profile(stamp, [25, 25], 1)[1] for stamp in stamps]
+    # Assert
+    assert _radius_index.cache_info().hits >= hits + 2
+    np.testing.assert_allclose(profiles, np.ones_like(profiles))
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])